@@ -5,9 +5,26 @@ A Streamlit application for searching paint products across multiple catalogs
 """
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+import hashlib
+from collections import defaultdict
 from pathlib import Path
-from fuzzywuzzy import fuzz
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from rapidfuzz import fuzz, process, utils
+
+# Most matches the results table renders - the count still covers every match
+MAX_DISPLAY_RESULTS = 200
+
+# Bump when the cached catalog columns change - older Parquet caches are then re-parsed
+CACHE_VERSION = 1
+
+# Text cells pandas' Excel reader treated as missing by default
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
 
 # Page configuration
 st.set_page_config(
@@ -20,11 +37,135 @@ st.set_page_config(
 st.title("🎨 Paint Products Search")
 st.markdown("Search across Akzo, Crown, and PPG paint catalogs")
 
-# Cache the catalog loading
-@st.cache_data
+def cell_value(row, col):
+    """Return a cell from a values-only row, with Excel errors and NA strings as None."""
+    value = row[col] if col < len(row) else None
+    return None if value in ERROR_CODES or value in NA_STRINGS else value
+
+def data_width(row):
+    """Return a values-only row's width without its trailing empty cells, as pandas counted it."""
+    width = len(row)
+    while width and row[width - 1] in (None, ''):
+        width -= 1
+    return width
+
+def read_sheet_columns(worksheet, columns):
+    """Stream a read-only worksheet's wanted columns into lists, plus its data width."""
+    # Rows come back as wide as their data, rather than padded or cut to the
+    # size the file declares
+    worksheet.reset_dimensions()
+    values = {name: [] for name in columns}
+    width = 0
+    for row in worksheet.iter_rows(values_only=True):
+        if len(row) > width:
+            width = max(width, data_width(row))
+        for name, col in columns.items():
+            values[name].append(cell_value(row, col))
+    return values, width
+
+def build_token_index(*columns):
+    """Map each whole word to the set of row positions containing it."""
+    index = defaultdict(set)
+    for column in columns:
+        for row, text in enumerate(column):
+            for token in text.split():
+                index[token].add(row)
+    return dict(index)
+
+def read_catalog_workbook(filepath, catalog_name, config):
+    """Read one catalog workbook into a clean Code/Product/Price/Catalog dataframe."""
+    # Stream the workbook - read-only mode parses rows lazily instead of
+    # materialising every cell of every sheet
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    
+    try:
+        # Extract code, description and price columns
+        code_col = config['code_col']
+        desc_col = config['desc_col']
+        price_col = config['price_col']
+        extra_cols = config.get('extra_cols', [])
+        
+        # Pull just the needed columns out of the row stream, straight into one
+        # list per column rather than a list per row
+        columns = {'code': code_col, 'desc': desc_col, 'price': price_col}
+        columns.update({f'extra_{col}': col for col in extra_cols})
+        
+        # Load the appropriate sheet
+        sheet_name = None
+        
+        # Special handling for Crown - use second sheet
+        if catalog_name == 'Crown' and len(workbook.sheetnames) > 1:
+            sheet_name = workbook.sheetnames[1]
+            values, width = read_sheet_columns(workbook[sheet_name], columns)
+        else:
+            # For others, find first sheet with enough columns of actual data
+            for sname in workbook.sheetnames:
+                values, width = read_sheet_columns(workbook[sname], columns)
+                if width > desc_col:
+                    sheet_name = sname
+                    break
+        
+        if not sheet_name:
+            return None
+        worksheet = workbook[sheet_name]
+        
+        # Price column beyond the data - use the last column instead
+        if 0 < width <= price_col:
+            values['price'] = [
+                cell_value(row, width - 1) for row in worksheet.iter_rows(values_only=True)
+            ]
+        sheet = pd.DataFrame(values, dtype=object)
+    finally:
+        # Read-only workbooks keep the file open until closed
+        workbook.close()
+    
+    # Create a clean dataframe with code, descriptions and prices - Arrow-backed
+    # strings sit in one contiguous buffer, so the str kernels below scan it directly
+    desc = sheet['desc'].astype('string[pyarrow]')
+    
+    # Add extra columns to description (for Crown) - each non-empty part carries its
+    # own leading space, so a single str.cat appends them all without gaps
+    if extra_cols:
+        extras = [
+            sheet[f'extra_{col}'].astype('string[pyarrow]').str.strip().fillna('')
+            for col in extra_cols
+        ]
+        desc = desc.str.cat(
+            [(' ' + extra).where(extra != '', '') for extra in extras],
+            na_rep=''
+        )
+    
+    # Skip empty descriptions
+    desc = desc.str.strip()
+    keep = (desc.notna() & (desc != '')).to_numpy()
+    
+    # Format price to 2 decimal places, keeping non-numeric prices as text - one
+    # numeric coercion pass, then one vectorised %-format over the whole column
+    price = sheet['price']
+    price_num = pd.to_numeric(price, errors='coerce')
+    formatted_price = pd.Series(
+        np.where(
+            price_num.notna(),
+            np.char.mod('£%.2f', price_num.to_numpy(dtype=float)),
+            price.fillna('N/A').astype(str)
+        ),
+        dtype='string[pyarrow]'
+    )
+    
+    # Codes are stored as text so the frame can round-trip through Parquet
+    products_df = pd.DataFrame({
+        'Code': sheet['code'].fillna('N/A').astype('string[pyarrow]')[keep],
+        'Product': desc[keep],
+        'Price': formatted_price[keep],
+        'Catalog': catalog_name
+    }).reset_index(drop=True)
+    return products_df
+
+# Cache the catalog loading - shared read-only across sessions, never mutated
+@st.cache_resource
 def load_paint_catalogs():
-    """Load all paint catalog Excel files."""
-    catalogs = {}
+    """Load all paint catalog Excel files into one frame, via their Parquet cache when up to date."""
+    catalogs = []
     data_dir = os.path.join(os.path.dirname(__file__), 'data', 'paint')
     
     # Define catalog configuration
@@ -52,85 +193,163 @@ def load_paint_catalogs():
     
     for catalog_name, config in catalog_config.items():
         filepath = os.path.join(data_dir, config['filename'])
+        cache_path = os.path.splitext(filepath)[0] + '.parquet'
         
         try:
             if os.path.exists(filepath):
-                excel_file = pd.ExcelFile(filepath)
+                # A cache is only reused for this loader version, column layout and
+                # exact workbook - copies that keep an older mtime still count as changed
+                source = os.stat(filepath)
+                cache_meta = {
+                    'cache_version': CACHE_VERSION,
+                    'config': hashlib.sha1(repr(sorted(config.items())).encode()).hexdigest(),
+                    'source_mtime_ns': source.st_mtime_ns,
+                    'source_size': source.st_size
+                }
                 
-                # Load the appropriate sheet
-                sheet_name = None
-                df = None
+                products_df = None
+                if os.path.exists(cache_path):
+                    try:
+                        products_df = pd.read_parquet(cache_path)
+                    except Exception:
+                        # An unreadable cache is rebuilt from the workbook
+                        products_df = None
+                    if products_df is not None and any(
+                        products_df.attrs.get(key) != value for key, value in cache_meta.items()
+                    ):
+                        products_df = None
                 
-                # Special handling for Crown - use second sheet
-                if catalog_name == 'Crown' and len(excel_file.sheet_names) > 1:
-                    sheet_name = excel_file.sheet_names[1]
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-                else:
-                    # For others, find first sheet with enough columns
-                    for sname in excel_file.sheet_names:
-                        df_test = pd.read_excel(excel_file, sheet_name=sname, header=None)
-                        if df_test.shape[1] > config['desc_col']:
-                            sheet_name = sname
-                            df = df_test
-                            break
+                if products_df is None:
+                    products_df = read_catalog_workbook(filepath, catalog_name, config)
+                    if products_df is not None and not products_df.empty:
+                        # Normalised search columns, built once so queries skip per-row processing
+                        for col in ['Code', 'Product']:
+                            products_df[f'{col}_lc'] = products_df[col].map(
+                                utils.default_process
+                            ).astype('string[pyarrow]')
+                            # Sorted, de-duplicated tokens - the form token_set_ratio works on
+                            products_df[f'{col}_tokens'] = products_df[f'{col}_lc'].str.split().map(
+                                lambda tokens: ' '.join(sorted(set(tokens)))
+                            ).astype('string[pyarrow]')
+                        products_df.attrs.update(cache_meta)
+                        # Write beside the cache and swap it in, so readers never see a partial file
+                        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+                        try:
+                            products_df.to_parquet(tmp_path, compression='zstd')
+                            os.replace(tmp_path, cache_path)
+                        except OSError:
+                            # A read-only data directory just means no cache
+                            if os.path.exists(tmp_path):
+                                os.remove(tmp_path)
                 
-                if df is not None and sheet_name:
-                    # Extract code, description and price columns
-                    code_col = config['code_col']
-                    desc_col = config['desc_col']
-                    price_col = min(config['price_col'], df.shape[1] - 1)
-                    extra_cols = config.get('extra_cols', [])
-                    
-                    # Create a clean dataframe with code, descriptions and prices
-                    products = []
-                    for idx, row in df.iterrows():
-                        code = row.iloc[code_col] if code_col < len(row) else None
-                        desc = row.iloc[desc_col] if desc_col < len(row) else None
-                        price = row.iloc[price_col] if price_col < len(row) else None
-                        
-                        # Add extra columns to description (for Crown)
-                        if extra_cols:
-                            extra_parts = []
-                            for col_idx in extra_cols:
-                                if col_idx < len(row):
-                                    extra = row.iloc[col_idx]
-                                    if pd.notna(extra) and str(extra).strip():
-                                        extra_parts.append(str(extra).strip())
-                            if extra_parts:
-                                desc = f"{desc} {' '.join(extra_parts)}" if desc else ' '.join(extra_parts)
-                        
-                        # Skip empty descriptions
-                        if desc and pd.notna(desc) and str(desc).strip():
-                            # Format price to 2 decimal places
-                            formatted_price = 'N/A'
-                            if pd.notna(price) and price != 'N/A':
-                                try:
-                                    formatted_price = f"£{float(price):.2f}"
-                                except (ValueError, TypeError):
-                                    formatted_price = str(price)
-                            
-                            products.append({
-                                'Code': code if pd.notna(code) else 'N/A',
-                                'Product': str(desc).strip(),
-                                'Price': formatted_price,
-                                'Catalog': catalog_name
-                            })
-                    
-                    if products:
-                        catalogs[catalog_name] = {
-                            'data': pd.DataFrame(products),
-                            'sheet': sheet_name
-                        }
+                if products_df is not None and not products_df.empty:
+                    catalogs.append(products_df)
         
         except Exception as e:
             st.warning(f"Could not load {catalog_name} catalog: {e}")
     
-    return catalogs
+    # Search one union of the catalogs - only the union is kept, not each frame as well
+    if not catalogs:
+        return None
+    return pd.concat(catalogs, ignore_index=True)
+
+# Cache the search indexes - built once over the loaded catalogs
+@st.cache_resource
+def load_search_index():
+    """Build a word index and token lengths over the loaded catalogs."""
+    products = load_paint_catalogs()
+    return {
+        'data': products,
+        'tokens': build_token_index(products['Code_lc'], products['Product_lc']),
+        # Token string lengths, for the prefilter's length bound
+        'code_len': products['Code_tokens'].str.len().to_numpy(),
+        'product_len': products['Product_tokens'].str.len().to_numpy()
+    }
+
+# Cache search results - repeated or re-typed queries skip scoring entirely
+@st.cache_data(max_entries=128)
+def run_search(search_terms, catalog_filter):
+    """Fuzzy-search the catalogs for a tuple of normalised terms, returning matches and their scores."""
+    search_index = load_search_index()
+    products = search_index['data']
+    # A term with no letters or digits left scores 0 against every row
+    if not search_terms or not all(search_terms):
+        return products.iloc[:0][['Code', 'Product', 'Price', 'Catalog']], np.array([], dtype=int)
+    
+    # Only rows in the selected catalog are considered at all
+    if catalog_filter == "All":
+        in_catalog = np.ones(len(products), dtype=bool)
+    else:
+        in_catalog = (products['Catalog'] == catalog_filter).to_numpy()
+    
+    # Prefilter - a term reaches 50 only as a whole word or against tokens at most 3x its length
+    code_len, product_len = search_index['code_len'], search_index['product_len']
+    candidates = in_catalog.copy()
+    # Whole-word hits score 100, so rows holding every term skip scoring
+    word_hits = np.zeros((len(search_terms), len(products)), dtype=bool)
+    for term, has_word in zip(search_terms, word_hits):
+        if ' ' in term:
+            # Multi-token terms like "2.5l" get no shortcuts
+            continue
+        has_word[list(search_index['tokens'].get(term, set()))] = True
+        max_len = 3 * len(term)
+        candidates &= has_word | (code_len <= max_len) | (product_len <= max_len)
+    exact = word_hits.all(axis=0) & in_catalog
+    rows = np.flatnonzero(candidates & ~exact)
+    
+    # Use fuzzy matching for both Code and Product columns
+    # Each column is only scored where it is short enough to reach 50 for some term
+    words = [i for i, term in enumerate(search_terms) if ' ' not in term]
+    longest = 3 * max((len(search_terms[i]) for i in words), default=0)
+    code_pos = np.flatnonzero(code_len[rows] <= longest)
+    product_pos = np.flatnonzero(product_len[rows] <= longest)
+    code_scores = np.zeros((len(search_terms), len(rows)), dtype=np.uint8)
+    product_scores = np.zeros((len(search_terms), len(rows)), dtype=np.uint8)
+    if words:
+        # Without a shared word, token_set_ratio is a plain ratio against the sorted tokens
+        word_scores = process.cdist(
+            [search_terms[i] for i in words],
+            np.concatenate([
+                products['Code_tokens'].take(rows[code_pos]).to_numpy(),
+                products['Product_tokens'].take(rows[product_pos]).to_numpy()
+            ]),
+            scorer=fuzz.ratio, score_cutoff=50, dtype=np.uint8, workers=-1
+        )
+        code_scores[np.ix_(words, code_pos)] = word_scores[:, :len(code_pos)]
+        product_scores[np.ix_(words, product_pos)] = word_scores[:, len(code_pos):]
+    # Multi-token terms keep full token_set_ratio against the normalised strings
+    phrases = [i for i, term in enumerate(search_terms) if ' ' in term]
+    if phrases:
+        phrase_scores = process.cdist(
+            [search_terms[i] for i in phrases],
+            np.concatenate([
+                products['Code_lc'].take(rows).to_numpy(),
+                products['Product_lc'].take(rows).to_numpy()
+            ]),
+            scorer=fuzz.token_set_ratio, score_cutoff=50, dtype=np.uint8, workers=-1
+        )
+        code_scores[phrases], product_scores[phrases] = np.split(phrase_scores, 2, axis=1)
+    # Best column per term
+    term_scores = np.maximum(code_scores, product_scores)
+    if len(search_terms) == 1:
+        scores = term_scores[0]
+    else:
+        # Worst term per row, with whole-word hits at 100 - all terms must match
+        term_scores[word_hits[:, rows]] = 100
+        scores = term_scores.min(axis=0)
+    
+    # Keep matches with score >= 50 (50% similarity on ALL terms)
+    row_scores = np.where(exact, 100, 0).astype(np.uint8)
+    row_scores[rows] = scores
+    match_rows = np.flatnonzero(row_scores >= 50)
+    # Fresh slice of the display columns - the cached frame is never written to
+    matching = products.iloc[match_rows][['Code', 'Product', 'Price', 'Catalog']].reset_index(drop=True)
+    return matching, row_scores[match_rows].astype(int)
 
 # Load catalogs
-catalogs = load_paint_catalogs()
+products = load_paint_catalogs()
 
-if not catalogs:
+if products is None:
     st.error("No paint catalogs found. Please ensure Excel files are in data/paint/ directory.")
 else:
     # Create search interface
@@ -159,52 +378,31 @@ else:
     
     # Perform search if query entered
     if search_query or search_button:
-        query_lower = search_query.lower() if search_query else ""
-        
-        if not query_lower:
+        if not search_query:
             st.info("Enter a search term to find products")
         else:
-            # Search across all catalogs using fuzzy matching
-            results = []
+            # Split search query into individual words, each normalised (and lowercased)
+            # like the catalog strings
+            search_terms = tuple(utils.default_process(term) for term in search_query.split())
             
-            # Split search query into individual words
-            search_terms = query_lower.split()
-            
-            for catalog_name, catalog_data in catalogs.items():
-                df = catalog_data['data'].copy()
-                # Use fuzzy matching for both Code and Product columns
-                # Calculate match scores for each row - all terms must match
-                df['match_score'] = df.apply(
-                    lambda row: min(
-                        max(
-                            fuzz.token_set_ratio(term, str(row['Code']).lower()),
-                            fuzz.token_set_ratio(term, row['Product'].lower())
-                        )
-                        for term in search_terms
-                    ) if search_terms else 0,
-                    axis=1
-                )
-                # Keep matches with score >= 50 (50% similarity on ALL terms)
-                matching = df[df['match_score'] >= 50].copy()
-                matching = matching.drop('match_score', axis=1)
-                results.append(matching)
-            
-            # Combine results
-            all_results = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+            # Search across all catalogs at once using fuzzy matching
+            all_results, all_scores = run_search(search_terms, catalog_filter)
             
             # Display results
             if len(all_results) > 0:
-                # Filter results based on selection
-                if catalog_filter == "All":
-                    filtered_results = all_results
-                else:
-                    filtered_results = all_results[all_results['Catalog'] == catalog_filter]
+                st.success(f"Found {len(all_results)} product(s) in {catalog_filter}")
                 
-                st.success(f"Found {len(filtered_results)} product(s) in {catalog_filter}")
+                # Rank only what will be shown - partition out the best K matches, then
+                # sort just those. The key orders by score, with ties in catalog order
+                rank_key = -all_scores * len(all_scores) + np.arange(len(all_scores))
+                if len(all_results) > MAX_DISPLAY_RESULTS:
+                    top = np.argpartition(rank_key, MAX_DISPLAY_RESULTS - 1)[:MAX_DISPLAY_RESULTS]
+                    st.caption(f"Showing the top {MAX_DISPLAY_RESULTS} matches")
+                else:
+                    top = np.arange(len(all_results))
+                top = top[np.argsort(rank_key[top])]
                 
-                # Display single table - ensure Code is string to keep left alignment
-                display_results = filtered_results[['Code', 'Product', 'Price', 'Catalog']].copy()
-                display_results['Code'] = display_results['Code'].astype(str)
-                st.table(display_results)
+                # Display single table - Code is stored as text, so it stays left aligned
+                st.table(all_results.iloc[top])
             else:
                 st.warning(f"No products found matching '{search_query}'. Try different keywords.")